@@ -4,291 +4,278 @@
 1. 串口通信：监听单片机的天气请求信号（GET_WEATHER）
 2. 天气API：调用接口获取最新天气数据，存储到JSON文件
 3. 数据传输：将格式化后的天气数据通过串口发送给单片机
-依赖库：pyserial, requests, pyjwt, python-dotenv, cryptography
+依赖库：pyserial, urllib3, pyjwt, python-dotenv, cryptography, orjson
+天气API与历史记录的实现位于weather_core.py，与weather.py共用
 环境配置：需创建.env文件，放置API相关配置；需准备ed25519-private.pem私钥文件
 """
 import os
 import re
-import json
+import logging
 import time
 import serial
 import sys
-import jwt
-import requests
-from dotenv import load_dotenv
+from operator import attrgetter
 from typing import Optional
 
-# ====================== 路径与环境变量初始化（核心修改） ======================
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-load_dotenv(os.path.join(BASE_DIR, ".env"))
+# 导入weather_core时即完成.env加载，因此需先于下方读取环境变量的配置
+from weather_core import (
+    BASE_DIR,
+    ENCODING,
+    ENV_FILE,
+    LOG_LEVEL,
+    PRIVATE_KEY_FILE,
+    WeatherRecord,
+    get_weather,
+    save_history,
+)
 
 # ====================== 全局配置 ======================
 # 串口配置
 SERIAL_PORT = os.getenv("SERIAL_PORT", "COM3")
 BAUDRATE = int(os.getenv("BAUDRATE", 115200))
-TIMEOUT = 2
+TIMEOUT = 0.5  # 阻塞读超时，兼顾断连检测与Ctrl+C响应
 REQ_SIGNAL_STR = "GET_WEATHER"
-POLL_INTERVAL = 0.01
-ALLOWED_SUFFIXES = ("\r\n", "\n", "\r")
-
-# 天气API与JSON配置
-JSON_FILE = os.path.join(BASE_DIR, "hangzhou_weather_history.json")
-ENCODING = "utf-8"
-PRIVATE_KEY_FILE = os.path.join(BASE_DIR, "ed25519-private.pem")
+REQ_SIGNAL_BYTES = REQ_SIGNAL_STR.encode("ascii")  # 按字节比较，无需解码
+# 未带帧尾的半帧中，前后为空白或边界的请求信号才视为一次请求
+REQ_SIGNAL_RE = re.compile(rb"(?<!\S)" + re.escape(REQ_SIGNAL_BYTES) + rb"(?!\S)")
+FRAME_ENDINGS = (b"\r", b"\n")
+MAX_FRAME_SIZE = 4096  # 半帧超过该长度仍无帧尾时直接按一帧处理，防止缓冲区无限增长
+
+# 天气数据缓存配置
+WEATHER_CACHE_TTL = 120  # 天气数据缓存秒数，期间的重复请求直接复用
+
+# 发送帧配置
+FRAME_END = b"\r\n"
+ERROR_REPLY = "ERROR:获取天气数据失败".encode(ENCODING) + FRAME_END
+# 按单片机解析顺序一次取出字段：0时间 1温度 2体感 3降水量 4图标 5湿度
+MCU_FIELDS = attrgetter(
+    "record_time", "temp", "feels_like", "precip", "icons", "humidity"
+)
 
 # 全局变量
-ser: Optional[serial.Serial] = None
+log = logging.getLogger("handler")
+weather_cache = {"data": None, "expires": 0.0}  # 最近一次API结果及其过期时刻
+
+
+# ====================== 串口通信模块 ======================
+def is_request(frame: bytes) -> bool:
+    """检查接收的数据帧是否为单片机的有效请求信号（单片机发送的信号带前导空格）"""
+    return frame.strip() == REQ_SIGNAL_BYTES
+
+
+def pop_frames(pending: bytearray) -> list:
+    r"""从接收缓冲区取出所有完整帧，未收完的半帧留在缓冲区中
+
+    以\r或\n结尾的行整行作为一帧，由is_request精确匹配；单片机发送的请求信号不带帧尾，
+    因此仅在未结束的半帧中查找以空白分隔的独立请求信号，将其（及之前的数据）立即取出
+
+    >>> buf = bytearray(b"GET_WEATHER_NOW\r\necho GET_WEATHER ok\r\n")
+    >>> pop_frames(buf)
+    [b'GET_WEATHER_NOW\r\n', b'echo GET_WEATHER ok\r\n']
+    >>> buf = bytearray(b"\x00 GET_WEATHER GET_WEATHER GET_WEA")
+    >>> pop_frames(buf), bytes(buf)
+    ([b'\x00 ', b'GET_WEATHER', b'GET_WEATHER'], b' GET_WEA')
+    >>> buf += b"THER"
+    >>> pop_frames(buf), bytes(buf)
+    ([b'GET_WEATHER'], b'')
+    >>> buf = bytearray(b"GET_WEATHER_NOW")
+    >>> pop_frames(buf), bytes(buf)
+    ([], b'GET_WEATHER_NOW')
+    """
+    frames = bytes(pending).splitlines(keepends=True)
+    rest = b""
+    if frames and not frames[-1].endswith(FRAME_ENDINGS):
+        rest = frames.pop()
+
+    start = 0
+    for match in REQ_SIGNAL_RE.finditer(rest):
+        if rest[start : match.start()].strip():
+            frames.append(rest[start : match.start()])
+        frames.append(REQ_SIGNAL_BYTES)
+        start = match.end()
+    rest = rest[start:]
+
+    if len(rest) > MAX_FRAME_SIZE:
+        frames.append(rest)
+        rest = b""
+    pending[:] = rest
+    return frames
+
+
+class MCUListener:
+    """单片机串口监听器：持有串口对象，负责连接、收发数据帧与断线重连"""
+
+    def __init__(self, port: str = SERIAL_PORT, baudrate: int = BAUDRATE) -> None:
+        self.port = port
+        self.baudrate = baudrate
+        self.ser: Optional[serial.Serial] = None
+
+    def open(self) -> bool:
+        """初始化串口，失败则返回False"""
+        try:
+            self.close()
+            self.ser = serial.Serial(
+                port=self.port,
+                baudrate=self.baudrate,
+                bytesize=serial.EIGHTBITS,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                timeout=TIMEOUT,
+            )
+            if self.ser.is_open:
+                log.info("✅ 串口初始化成功：%s（波特率：%s）", self.port, self.baudrate)
+                self.enable_low_latency()
+                return True
+        except serial.SerialException as e:
+            log.error("❌ 串口初始化失败：%s", e)
+            log.error("请检查：1.COM口是否正确 2.串口是否被其他程序占用 3.单片机是否正常连接")
+        except Exception as e:
+            log.error("❌ 串口未知错误：%s", e)
+        return False
 
+    def enable_low_latency(self) -> None:
+        """Linux下开启串口ASYNC_LOW_LATENCY，USB转串口数据不再等待约16ms的延迟定时器"""
+        if not sys.platform.startswith("linux"):
+            return
+        try:
+            self.ser.set_low_latency_mode(True)
+            log.info("⚡ 已开启串口低延迟模式")
+        except (AttributeError, ValueError) as e:
+            # 部分驱动（如CDC-ACM）不支持TIOCSSERIAL，保持默认模式即可
+            log.debug("串口不支持低延迟模式：%s", e)
+
+    def close(self) -> None:
+        """关闭串口（未打开时无操作）"""
+        if self.ser is not None and self.ser.is_open:
+            self.ser.close()
+            log.info("🔌 串口 %s 已关闭", self.port)
+
+    def send(self, payload: bytes) -> bool:
+        """向单片机发送已编码的数据帧（调用方负责附带帧尾\r\n），一次write写出"""
+        if self.ser is None or not self.ser.is_open:
+            log.error("❌ 串口未打开，发送失败")
+            return False
 
-# ====================== 串口通信模块（核心修改：增强打印） ======================
-def init_serial() -> bool:
-    """初始化串口，失败则返回False"""
-    global ser
-    try:
-        if ser is not None and ser.is_open:
-            ser.close()
-
-        ser = serial.Serial(
-            port=SERIAL_PORT,
-            baudrate=BAUDRATE,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=TIMEOUT,
-        )
-        if ser.is_open:
-            print(f"✅ 串口初始化成功：{SERIAL_PORT}（波特率：{BAUDRATE}）")
+        try:
+            self.ser.write(payload)
+            self.ser.flush()
+            sent_str = payload.decode(ENCODING, errors="ignore").strip()
+            log.info("📤 已向单片机发送数据：%s", sent_str)
             return True
-    except serial.SerialException as e:
-        print(f"❌ 串口初始化失败：{e}")
-        print("请检查：1.COM口是否正确 2.串口是否被其他程序占用 3.单片机是否正常连接")
-    except Exception as e:
-        print(f"❌ 串口未知错误：{e}")
-    return False
-
-
-def check_request_signal(recv_str: str) -> bool:
-    """检查接收的字符串是否为单片机的有效请求信号"""
-    for suffix in ALLOWED_SUFFIXES:
-        if recv_str.endswith(suffix):
-            recv_str = recv_str[: -len(suffix)]
-            break
-    return recv_str.strip() == REQ_SIGNAL_STR
-
-
-def send_data_to_mcu(data: str) -> bool:
-    """向单片机发送数据（带帧尾\r\n）"""
-    global ser
-    if ser is None or not ser.is_open:
-        print("❌ 串口未打开，发送失败")
+        except serial.SerialException as e:
+            log.error("❌ 串口发送失败：%s", e)
+        except Exception as e:
+            log.error("❌ 发送异常：%s", e)
         return False
 
+    def handle_frame(self, frame: bytes) -> None:
+        """处理一帧接收数据：请求信号则回复天气数据，否则记录为普通数据"""
+        # 1. 记录原始字节（%r保留换行/回车符，仅DEBUG级别才格式化）
+        log.debug("📥 【原始字节】：%r", frame)
+
+        # 2. 区分有效请求和普通数据（直接比较字节，无需解码）
+        if is_request(frame):
+            log.info("✅ 检测到有效请求信号：%s，开始处理...", REQ_SIGNAL_STR)
+            self.send(process_mcu_request())
+            return
+
+        # 3. 普通数据解码为字符串（忽略无效字符）
+        clean_recv_str = frame.decode(ENCODING, errors="ignore").strip()
+        if clean_recv_str:  # 非空普通数据
+            log.info("ℹ️  收到普通串口数据：%s（非请求信号）", clean_recv_str)
+        else:  # 空数据（仅换行/回车）
+            log.debug("ℹ️  收到空数据（仅换行/回车符）")
+
+    def read_frames(self, pending: bytearray) -> None:
+        """在当前串口上持续读取并处理数据帧，串口异常时抛出由listen处理"""
+        # 串口对象与方法绑定为局部变量，避免循环内重复属性查找
+        ser = self.ser
+        read = ser.read
+        handle_frame = self.handle_frame
+        while True:
+            # 阻塞等待首字节（有数据即唤醒，超时返回空），再取走缓冲区剩余数据
+            head = read(1)
+            if not head:
+                # 线路空闲TIMEOUT仍无帧尾：残留数据按一帧处理并清空，避免影响后续请求
+                if pending:
+                    handle_frame(bytes(pending))
+                    pending.clear()
+                continue
+            pending += head + read(ser.in_waiting)
+
+            # 按帧处理，请求信号被拆分到两次读取或多条数据粘连时均能正确识别
+            for frame in pop_frames(pending):
+                handle_frame(frame)
+
+    def listen(self) -> None:
+        """持续监听单片机的请求信号（DEBUG级别下显示所有串口数据）"""
+        log.info("🔍 开始监听单片机请求（信号：%s），按Ctrl+C退出", REQ_SIGNAL_STR)
+        log.info("📢 串口波特率：%s，设置LOG_LEVEL=DEBUG可显示每帧接收数据", self.baudrate)
+        pending = bytearray()
+        while True:
+            try:
+                # 串口断连重连
+                if self.ser is None or not self.ser.is_open:
+                    log.warning("🔌 串口断开，尝试重新连接...")
+                    pending.clear()
+                    if not self.open():
+                        time.sleep(1)
+                        continue
+                self.read_frames(pending)
+            except KeyboardInterrupt:
+                log.info("🛑 用户中断程序")
+                break
+            except serial.SerialException as e:
+                log.error("❌ 串口异常：%s", e)
+                self.close()  # 关闭后由下一轮循环重新连接
+                time.sleep(1)
+            except Exception as e:
+                log.error("❌ 监听异常：%s", e)
+                time.sleep(1)
+
+
+# ====================== 数据格式化模块 ======================
+def format_weather_data(record: WeatherRecord) -> bytes:
+    """格式化天气数据为单片机可解析的竖线分隔数据帧（已编码，带帧尾\r\n）"""
+    return "|".join(map(str, MCU_FIELDS(record))).encode(ENCODING) + FRAME_END
+
+
+# ====================== 核心业务逻辑 ======================
+def process_mcu_request() -> bytes:
+    """处理单片机的天气请求：API获取（带短时缓存）→存JSON→返回待发送的数据帧"""
     try:
-        send_data = data + "\r\n"
-        ser.write(send_data.encode(ENCODING))
-        print(f"\n📤 已向单片机发送数据：{send_data.strip()}")
-        return True
-    except serial.SerialException as e:
-        print(f"❌ 串口发送失败：{e}")
-    except UnicodeEncodeError as e:
-        print(f"❌ 数据编码失败（请确保为UTF-8）：{e}")
-    except Exception as e:
-        print(f"❌ 发送异常：{e}")
-    return False
-
-
-# ====================== 天气API与JSON模块（无修改） ======================
-def load_private_key(file_path: str = PRIVATE_KEY_FILE) -> str:
-    """加载Ed25519私钥文件"""
-    key_path = (
-        os.path.join(BASE_DIR, file_path) if not os.path.isabs(file_path) else file_path
-    )
-    if not os.path.exists(key_path):
-        raise FileNotFoundError(f"私钥文件 {key_path} 不存在")
-    with open(key_path, "r", encoding=ENCODING) as f:
-        return f.read().strip()
-
-
-def generate_jwt(private_key: str) -> str:
-    """生成JWT令牌"""
-    try:
-        headers = {"alg": "EdDSA", "kid": os.getenv("JWT_KID"), "typ": None}
-        now = int(time.time())
-        payload = {
-            "sub": os.getenv("PROJECT_ID"),
-            "iat": now - 30,
-            "exp": now + int(os.getenv("JWT_EXPIRE", 86000)),
-        }
-        if not all([headers["kid"], payload["sub"]]):
-            raise ValueError("环境变量JWT_KID/PROJECT_ID未配置")
-        return jwt.encode(payload, private_key, algorithm="EdDSA", headers=headers)
-    except Exception as e:
-        raise Exception(f"JWT生成失败：{e}")
-
-
-def extract_city_name(fx_link: str) -> str:
-    """从fx_link中提取城市名称"""
-    city_en = re.search(r"weather/([a-zA-Z]+)-\d+", fx_link).group(1)
-    return {"hangzhou": "杭州"}.get(city_en, city_en)
-
-
-def get_weather_from_api() -> dict:
-    """调用天气API获取最新数据"""
-    try:
-        private_key = load_private_key()
-        jwt_token = generate_jwt(private_key)
-
-        url = f"https://{os.getenv('API_HOST')}/v7/weather/now"
-        headers = {"Authorization": f"Bearer {jwt_token}"}
-        params = {
-            "location": os.getenv("LOCATION_ID", "101210101"),
-            "lang": "en",
-        }
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-
-        print("\n" + "=" * 60)
-        print("接口回传的原始响应数据：")
-        print("=" * 60)
-        try:
-            raw_data = response.json()
-            print(json.dumps(raw_data, ensure_ascii=False, indent=4))
-        except json.JSONDecodeError:
-            print(f"非JSON响应：{response.text}")
-        print("=" * 60 + "\n")
-
-        data = response.json()
-        weather_info = {
-            "record_time": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "temp": data["now"]["temp"],
-            "feels_like": data["now"]["feelsLike"],
-            "precip": data["now"]["precip"],
-            "icons": data["now"]["icon"],
-            "humidity": data["now"].get("humidity", "0"),
-        }
-        print("\n🌤 从API获取最新天气数据（精简版）：")
-        for k, v in weather_info.items():
-            print(f"  {k.replace('_', ' ')}：{v}")
-        return weather_info
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"API请求失败：{e}")
-    except KeyError as e:
-        raise Exception(f"API返回数据格式错误，缺失字段：{e}")
-    except Exception as e:
-        raise Exception(f"获取天气数据失败：{e}")
-
-
-def save_weather_to_json(weather_data: dict) -> None:
-    """将天气数据保存到JSON文件"""
-    json_file = os.path.join(BASE_DIR, "hangzhou_weather_history.json")
-    if os.path.exists(json_file):
-        with open(json_file, "r", encoding=ENCODING) as f:
-            history_data = json.load(f)
-        if not isinstance(history_data, list):
-            history_data = []
-    else:
-        history_data = []
-
-    history_data.append(weather_data)
-    with open(json_file, "w", encoding=ENCODING) as f:
-        json.dump(history_data, f, ensure_ascii=False, indent=4)
-    print(f"💾 天气数据已保存到 {json_file}（共{len(history_data)}条记录）")
-
-
-def format_weather_data(weather_data: dict) -> str:
-    """格式化天气数据为单片机可解析的竖线分隔字符串"""
-    # 注意：修正字段顺序！原脚本顺序是 时间|温度|体感|图标|湿度|降水量
-    # 对应单片机解析的：0时间 1温度 2体感 3降水量 4图标 5湿度 → 这里顺序错误，是核心问题！
-    data_str = (
-        f"{weather_data['record_time']}|"  # 0: 时间
-        f"{weather_data['temp']}|"  # 1: 温度
-        f"{weather_data['feels_like']}|"  # 2: 体感温度
-        f"{weather_data['precip']}|"  # 3: 降水量（原脚本错把icons放这）
-        f"{weather_data['icons']}|"  # 4: 图标（原脚本错把humidity放这）
-        f"{weather_data['humidity']}"  # 5: 湿度（原脚本错把precip放这）
-    )
-    return data_str
-
-
-# ====================== 核心业务逻辑（无修改） ======================
-def process_mcu_request() -> None:
-    """处理单片机的天气请求：API获取→存JSON→格式化发送"""
-    try:
-        weather_data = get_weather_from_api()
-        save_weather_to_json(weather_data)
-        formatted_data = format_weather_data(weather_data)
-        send_data_to_mcu(formatted_data)
+        now = time.monotonic()
+        if weather_cache["data"] is not None and now < weather_cache["expires"]:
+            # 单片机用字段0校准时钟，缓存命中时须换成当前时间，避免时钟回拨
+            record_time = time.strftime("%Y-%m-%d %H:%M:%S")
+            record = weather_cache["data"]._replace(record_time=record_time)
+            log.info("♻️  复用%d秒内的缓存天气数据", WEATHER_CACHE_TTL)
+        else:
+            record = get_weather()
+            weather_cache.update(data=record, expires=now + WEATHER_CACHE_TTL)
+            save_history(record)
+        return format_weather_data(record)
     except Exception as e:
-        print(f"\n❌ 处理请求失败：{e}")
-        send_data_to_mcu("ERROR:获取天气数据失败")
-
-
-def listen_mcu_request() -> None:
-    """持续监听单片机的请求信号（核心修改：显示所有串口数据）"""
-    print(f"\n🔍 开始监听单片机请求（信号：{REQ_SIGNAL_STR}），按Ctrl+C退出")
-    print(f"📢 实时显示所有串口接收数据（波特率：{BAUDRATE}）")
-    print("-" * 80)
-    while True:
-        try:
-            # 串口断连重连
-            if ser is None or not ser.is_open:
-                print("\n🔌 串口断开，尝试重新连接...")
-                if not init_serial():
-                    time.sleep(1)
-                    continue
-
-            # 读取所有缓冲区数据（核心：显示每一条串口信息）
-            if ser.in_waiting > 0:
-                # 1. 读取原始字节并打印（避免转义丢失）
-                recv_bytes = ser.read(ser.in_waiting)
-                print(f"\n📥 【原始字节】：{repr(recv_bytes)}")
-
-                # 2. 解码为字符串（忽略无效字符）
-                recv_str = recv_bytes.decode(ENCODING, errors="ignore")
-                print(f"📥 【解码后】：{repr(recv_str)}")  # repr保留换行/回车符
-
-                # 3. 处理并检测请求信号
-                clean_recv_str = recv_str.strip()
-                print(f"📥 【处理后】：{clean_recv_str}")
-
-                # 4. 区分有效请求和普通数据
-                if check_request_signal(recv_str):
-                    print(f"\n✅ 检测到有效请求信号：{REQ_SIGNAL_STR}，开始处理...")
-                    process_mcu_request()
-                elif clean_recv_str:  # 非空普通数据
-                    print(f"ℹ️  收到普通串口数据：{clean_recv_str}（非请求信号）")
-                else:  # 空数据（仅换行/回车）
-                    print(f"ℹ️  收到空数据（仅换行/回车符）")
-
-                print("-" * 80)  # 分隔线，便于区分每条数据
-
-            time.sleep(POLL_INTERVAL)
-
-        except KeyboardInterrupt:
-            print("\n\n🛑 用户中断程序")
-            break
-        except Exception as e:
-            print(f"\n❌ 监听异常：{e}")
-            print("-" * 80)
-            time.sleep(1)
+        log.error("❌ 处理请求失败：%s", e)
+        return ERROR_REPLY
 
 
-# ====================== 主函数（无修改） ======================
+# ====================== 主函数 ======================
 def main() -> None:
     """程序入口：初始化串口→监听请求"""
-    print(f"📂 脚本所在目录：{BASE_DIR}")
-    print(f"🔑 私钥文件路径：{PRIVATE_KEY_FILE}")
-    print(f"🔧 .env文件路径：{os.path.join(BASE_DIR, '.env')}")
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
+    log.info("📂 脚本所在目录：%s", BASE_DIR)
+    log.info("🔑 私钥文件路径：%s", PRIVATE_KEY_FILE)
+    log.info("🔧 .env文件路径：%s", ENV_FILE)
 
-    if not init_serial():
+    listener = MCUListener()
+    if not listener.open():
         sys.exit(1)
 
     try:
-        listen_mcu_request()
+        listener.listen()
     finally:
-        if ser is not None and ser.is_open:
-            ser.close()
-            print(f"\n🔌 串口 {SERIAL_PORT} 已关闭")
+        listener.close()
         sys.exit(0)
 
 
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+天气核心模块（供Handeler.py与weather.py共用）：
+1. 配置：加载.env环境变量，集中定义路径与API配置
+2. 天气API：私钥与JWT缓存、复用HTTP连接池获取实时天气
+3. 历史记录：逐条追加写入JSONL，程序退出时合并写回JSON文件（多进程共用，加锁互斥）
+依赖库：urllib3, pyjwt, python-dotenv, cryptography, orjson
+"""
+import os
+import re
+import atexit
+import logging
+import time
+from contextlib import contextmanager
+from collections import namedtuple
+import orjson
+import jwt
+import urllib3
+from dotenv import load_dotenv
+from pathlib import Path
+from urllib.parse import urlencode
+from typing import Optional
+
+# ====================== 路径与环境变量初始化 ======================
+BASE_DIR = Path(__file__).resolve().parent
+ENV_FILE = BASE_DIR / ".env"
+ENV_LOADED_FLAG = "_WEATHER_ENV_LOADED"  # 进程内只解析一次.env（模块重载时跳过）
+if not os.environ.get(ENV_LOADED_FLAG):
+    load_dotenv(ENV_FILE, override=False)
+    os.environ[ENV_LOADED_FLAG] = "1"
+
+# ====================== 全局配置 ======================
+# 环境变量在导入时一次性读取为常量，运行期间不再调用os.getenv
+# 日志配置：默认INFO，设置LOG_LEVEL=DEBUG可查看每帧串口数据和API原始响应
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# 天气API与JSON配置
+JSON_FILE = BASE_DIR / "hangzhou_weather_history.json"
+JSONL_FILE = JSON_FILE.with_suffix(".jsonl")  # 运行期间逐条追加的记录，退出时合并进JSON_FILE
+HISTORY_LOCK_FILE = JSON_FILE.with_suffix(".lock")  # 历史文件的跨进程锁
+HISTORY_LOCK_TIMEOUT = 10  # 锁文件存在超过该秒数视为持锁进程异常退出，清除残留锁
+ENCODING = "utf-8"
+PRIVATE_KEY_FILE = BASE_DIR / "ed25519-private.pem"
+JWT_REFRESH_MARGIN = 60  # JWT距过期不足该秒数时重新签发
+JWT_HEADERS = {"alg": "EdDSA", "kid": os.getenv("JWT_KID"), "typ": None}
+JWT_SUB = os.getenv("PROJECT_ID")
+JWT_EXPIRE = int(os.getenv("JWT_EXPIRE", 86000))
+API_HOST = os.getenv("API_HOST")
+LOCATION_ID = os.getenv("LOCATION_ID", "101210101")
+# 请求URL固定不变，预先拼好查询参数
+API_URL = f"https://{API_HOST}/v7/weather/now?" + urlencode(
+    {"location": LOCATION_ID, "lang": "en"}
+)
+API_TIMEOUT = 10
+FX_LINK_RE = re.compile(r"weather/([a-zA-Z]+)-\d+")
+CITY_NAME_MAP = {"hangzhou": "杭州"}
+
+# 精简天气记录：前6个字段的顺序即单片机解析的顺序，weather_text仅用于展示和存档
+WeatherRecord = namedtuple(
+    "WeatherRecord",
+    (
+        "record_time",
+        "temp",
+        "feels_like",
+        "precip",
+        "icons",
+        "humidity",
+        "weather_text",
+    ),
+)
+
+# 全局变量
+log = logging.getLogger("weather_core")
+history_flush_registered = False  # 首次保存时注册退出时的合并写回
+private_key_cache: Optional[str] = None  # 私钥只读取一次
+jwt_cache = {"headers": None, "exp": 0}  # 复用已签发的JWT（含请求头）直到临近过期
+
+# HTTP连接池：复用TCP/TLS连接，避免每次请求重新握手；连接失败自动重试
+http_pool = urllib3.PoolManager(maxsize=1, retries=urllib3.Retry(total=2))
+BASE_HEADERS = urllib3.make_headers(accept_encoding=True)  # API响应为gzip压缩
+
+
+# ====================== 天气API模块 ======================
+def load_private_key(file_path: Path = PRIVATE_KEY_FILE) -> str:
+    """加载Ed25519私钥文件（相对路径基于脚本目录）"""
+    key_path = BASE_DIR / file_path  # file_path为绝对路径时拼接结果即为其本身
+    if not key_path.exists():
+        raise FileNotFoundError(f"私钥文件 {key_path} 不存在")
+    return key_path.read_text(encoding=ENCODING).strip()
+
+
+def generate_jwt(private_key: str) -> str:
+    """生成JWT令牌"""
+    try:
+        if not all([JWT_HEADERS["kid"], JWT_SUB]):
+            raise ValueError("环境变量JWT_KID/PROJECT_ID未配置")
+        now = int(time.time())
+        payload = {"sub": JWT_SUB, "iat": now - 30, "exp": now + JWT_EXPIRE}
+        return jwt.encode(payload, private_key, algorithm="EdDSA", headers=JWT_HEADERS)
+    except Exception as e:
+        raise Exception(f"JWT生成失败：{e}")
+
+
+def get_auth_headers() -> dict:
+    """获取带JWT令牌的请求头：复用缓存，临近过期时才重新签发"""
+    global private_key_cache
+    now = int(time.time())
+    if jwt_cache["exp"] - now < JWT_REFRESH_MARGIN:
+        if private_key_cache is None:
+            private_key_cache = load_private_key()
+        jwt_token = generate_jwt(private_key_cache)
+        jwt_cache["headers"] = {**BASE_HEADERS, "Authorization": f"Bearer {jwt_token}"}
+        jwt_cache["exp"] = now + JWT_EXPIRE
+    return jwt_cache["headers"]
+
+
+def extract_city_name(fx_link: str) -> str:
+    """从fx_link中提取城市名称"""
+    city_en = FX_LINK_RE.search(fx_link).group(1)
+    return CITY_NAME_MAP.get(city_en, city_en)
+
+
+def get_weather() -> WeatherRecord:
+    """调用天气API获取最新数据"""
+    try:
+        response = http_pool.request(
+            "GET", API_URL, headers=get_auth_headers(), timeout=API_TIMEOUT
+        )
+        if response.status == 401:
+            jwt_cache["exp"] = 0  # 令牌被拒绝，下次请求时重新签发
+        if response.status >= 400:
+            raise urllib3.exceptions.HTTPError(f"HTTP状态码 {response.status}")
+
+        # 响应体只解析一次；原始响应仅在DEBUG级别下输出
+        raw = response.data
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("接口回传的原始响应数据：%s", raw.decode(ENCODING, errors="replace"))
+        now = orjson.loads(raw)["now"]
+        record = WeatherRecord(
+            record_time=time.strftime("%Y-%m-%d %H:%M:%S"),
+            temp=now["temp"],
+            feels_like=now["feelsLike"],
+            precip=now["precip"],
+            icons=now["icon"],
+            humidity=now.get("humidity", "0"),
+            weather_text=now.get("text", ""),
+        )
+        log.info("🌤 从API获取最新天气数据（精简版）：")
+        for k, v in zip(record._fields, record):
+            log.info("  %s：%s", k.replace("_", " "), v)
+        return record
+    except urllib3.exceptions.HTTPError as e:
+        raise Exception(f"API请求失败：{e}")
+    except KeyError as e:
+        raise Exception(f"API返回数据格式错误，缺失字段：{e}")
+    except orjson.JSONDecodeError as e:
+        raise Exception(f"API返回非JSON数据：{e}")
+    except Exception as e:
+        raise Exception(f"获取天气数据失败：{e}")
+
+
+# ====================== 历史记录模块 ======================
+def is_history_lock_stale() -> bool:
+    """锁文件的修改时间早于HISTORY_LOCK_TIMEOUT则视为持锁进程已异常退出"""
+    try:
+        age = time.time() - HISTORY_LOCK_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return age > HISTORY_LOCK_TIMEOUT
+
+
+@contextmanager
+def history_lock():
+    """以锁文件互斥访问历史文件，Handeler.py与weather.py同时运行时互不覆盖"""
+    token = f"{os.getpid()}-{time.time_ns()}".encode("ascii")  # 标识本次持锁
+    deadline = time.monotonic() + 2 * HISTORY_LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(HISTORY_LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # 先按锁的年龄判断：残留锁立即清除，不必等满超时
+            if is_history_lock_stale():
+                log.warning("⚠️  清除残留的历史记录锁：%s", HISTORY_LOCK_FILE)
+                HISTORY_LOCK_FILE.unlink(missing_ok=True)
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"等待历史记录锁超时：{HISTORY_LOCK_FILE}")
+            time.sleep(0.05)
+            continue
+        try:
+            os.write(fd, token)
+        finally:
+            os.close(fd)
+        break
+    try:
+        yield
+    finally:
+        # 只删除仍属于本次持锁的锁文件，不误删其他进程的锁
+        try:
+            if HISTORY_LOCK_FILE.read_bytes() == token:
+                HISTORY_LOCK_FILE.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def load_weather_history() -> list:
+    """加载历史记录：JSON_FILE中的完整列表 + 尚未合并的JSONL追加记录"""
+    history_data = []
+    if JSON_FILE.exists():
+        history_data = orjson.loads(JSON_FILE.read_bytes())
+        if not isinstance(history_data, list):
+            history_data = []
+    if JSONL_FILE.exists():
+        with JSONL_FILE.open("rb") as f:
+            history_data.extend(orjson.loads(line) for line in f if line.strip())
+    return history_data
+
+
+def flush_weather_history() -> None:
+    """持锁重新读取磁盘上的JSON与JSONL（含其他进程追加的记录），合并写回JSON_FILE"""
+    with history_lock():
+        if not JSONL_FILE.exists():
+            return
+        history_data = load_weather_history()
+        # 一次序列化为UTF-8字节后以二进制模式写入临时文件，再原子替换
+        tmp_file = JSON_FILE.with_suffix(".tmp")
+        tmp_file.write_bytes(orjson.dumps(history_data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, JSON_FILE)
+        JSONL_FILE.unlink()
+    log.info("💾 历史记录已写回 %s（共%d条记录）", JSON_FILE, len(history_data))
+
+
+def save_history(record: WeatherRecord) -> None:
+    """保存天气数据：持锁追加一行到JSONL文件，完整JSON在程序退出时合并写回"""
+    global history_flush_registered
+    if not history_flush_registered:
+        atexit.register(flush_weather_history)
+        history_flush_registered = True
+
+    with history_lock():
+        with JSONL_FILE.open("ab") as f:
+            f.write(orjson.dumps(record._asdict()) + b"\n")
+    log.info("💾 天气数据已追加到 %s", JSONL_FILE)